@@ -1,9 +1,20 @@
-from fastapi import FastAPI, HTTPException # Importe HTTPException pour des réponses d'erreur claires
-from pydantic import BaseModel
-import pandas as pd
+from fastapi import FastAPI, HTTPException, Request # Importe HTTPException pour des réponses d'erreur claires
+from fastapi.responses import Response
+import orjson # Sérialisation JSON rapide, avec prise en charge native de NumPy
+import msgspec # Décodage et validation du corps JSON de /predict, sans passer par Pydantic
 import numpy as np
 import joblib
+import asyncio # Pour la file de micro-batching devant le modèle et l'explainer
+from collections import OrderedDict # Cache LRU des réponses de /predict
+from concurrent.futures import ThreadPoolExecutor # Threads dédiés au calcul du score et des valeurs SHAP
+import logging
 import os # Pour vérifier l'existence des fichiers
+import sys
+from create_explainer import build_explainer # Construction (déterministe) de l'explainer SHAP
+
+# Niveau de log configurable (LOG_LEVEL=DEBUG pour réactiver les traces détaillées de chaque requête)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="API de Prédiction de Risque Client Neo-Banque",
@@ -11,214 +22,404 @@ app = FastAPI(
 )
 
 # 1. Définition des données attendues pour la requête POST /predict
-class ClientData(BaseModel):
+class ClientData(msgspec.Struct):
     age: int
     revenu: float
     anciennete: int # Ancienneté du client en mois ou années
     nb_incidents: int # Nombre d'incidents (par exemple, de paiement ou techniques)
     score_credit: int # Score de crédit actuel du client (ex: FICO, score interne)
 
-# 2. Définition des chemins absolus ou relatifs vers les fichiers du modèle et de l'explainer
+# Décodeur réutilisé pour chaque requête. strict=False : accepte comme Pydantic un nombre flottant
+# entier (ex. 592.0, envoyé par le dashboard) pour un champ int.
+client_data_decoder = msgspec.json.Decoder(ClientData, strict=False)
+
+# 2. Définition des chemins absolus ou relatifs vers les fichiers du modèle
 # Assurez-vous que ces chemins sont corrects sur votre système et dans l'environnement de déploiement (Render).
 MODEL_PATH = "app/model.pkl"
-EXPLAINER_PATH = "app/explainer.pkl"
+# L'explainer n'est pas picklé : il est reconstruit au démarrage à partir du modèle (voir create_explainer.py)
+# Export ONNX optionnel du modèle (généré par convert_model_onnx.py), utilisé pour le score s'il est présent
+# et si onnxruntime est installé (dépendance optionnelle, absente de requirements.txt)
+ONNX_MODEL_PATH = "app/model.onnx"
+
+# Paramètres du micro-batching : nombre maximal de requêtes regroupées en un seul appel
+# au modèle / à l'explainer, et temps d'attente maximal (en millisecondes) pour remplir un lot.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+MAX_LATENCY_MS = float(os.getenv("MAX_LATENCY_MS", "10"))
+# Nombre de threads de calcul (score + SHAP) par worker, donc de lots pouvant être calculés en parallèle.
+# 1 par défaut : les workers uvicorn occupent déjà un CPU chacun, et un seul thread laisse les requêtes
+# s'accumuler dans la file pendant le calcul d'un lot (lots plus gros). À n'augmenter qu'avec un seul worker.
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1"))
+
+# Nombre maximal de réponses mises en cache (clé : les 5 valeurs d'entrée). 0 désactive le cache.
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
 
 # Initialisation des variables globales pour le modèle et l'explainer
 model = None
 explainer = None
+onnx_session = None # Session onnxruntime, si l'export ONNX du modèle est disponible
+onnx_input_name = None
+onnx_proba_output = None
+extract_shap = None # Extracteur des valeurs SHAP de la classe positive, spécialisé au démarrage
+
+# File d'attente des requêtes de prédiction et tâche de fond qui la consomme (créées au démarrage)
+batch_queue = None
+batch_task = None
+inference_pool = None # ThreadPoolExecutor dédié au calcul des lots (hors de la boucle d'événements)
+pending_batches = set() # Lots en cours de calcul (référence conservée jusqu'à la fin de la tâche)
+
+# Cache LRU {(age, revenu, anciennete, nb_incidents, score_credit): corps JSON de la réponse} : un client déjà
+# scoré est servi sans repasser par le modèle, par SHAP ni par la sérialisation. Le modèle étant fixe après le démarrage, il n'expire pas.
+prediction_cache = OrderedDict()
 
 # Ordre attendu des fonctionnalités - C'EST CRUCIAL !
 # CETTE LISTE DOIT CORRESPONDRE EXACTEMENT À L'ORDRE ET AUX NOMS DES COLONNES
 # QUI ONT ÉTÉ UTILISÉES POUR ENTRAÎNER VOTRE MODÈLE ET CRÉER VOTRE EXPLAINER SHAP.
 expected_feature_order = ['age', 'revenu', 'anciennete', 'nb_incidents', 'score_credit']
+# Version figée (tuple de chaînes internées) utilisée par le code : aucune copie par requête
+FEATURE_NAMES = tuple(sys.intern(name) for name in expected_feature_order)
+
+# Gabarits des explications renvoyées au dashboard (formatage % : chemin rapide de CPython pour les floats).
+# Le dashboard analyse ces phrases : ne pas en modifier le texte.
+POS_TMPL = "La fonctionnalité '%s' impacte positivement la prédiction avec un poids de %.3f"
+NEG_TMPL = "La fonctionnalité '%s' impacte négativement la prédiction avec un poids de %.3f"
+EXPLANATION_TMPLS = (NEG_TMPL, POS_TMPL) # Indexé par le booléen "impact > 0"
 
 
 # 3. Chargement du modèle et de l'explainer au démarrage de l'application (une seule fois)
 @app.on_event("startup")
 def load_resources():
-    global model, explainer # Permet de modifier les variables globales définies plus haut
+    global model, explainer, onnx_session, onnx_input_name, onnx_proba_output # Permet de modifier les variables globales définies plus haut
 
-    print("Tentative de chargement des ressources (modèle et explainer)...")
+    logger.info("Tentative de chargement des ressources (modèle et explainer)...")
+
+    # Si l'export ONNX du modèle est disponible et qu'onnxruntime est installé, le score est calculé
+    # par onnxruntime (inférence des arbres en C++). Sinon on conserve model.predict_proba de scikit-learn.
+    # Dans les deux cas model.pkl reste chargé : l'explainer SHAP est construit à partir du modèle scikit-learn.
+    if os.path.exists(ONNX_MODEL_PATH):
+        try:
+            import onnxruntime as ort
+            onnx_session = ort.InferenceSession(ONNX_MODEL_PATH, providers=["CPUExecutionProvider"])
+            onnx_input_name = onnx_session.get_inputs()[0].name
+            onnx_proba_output = onnx_session.get_outputs()[1].name # Sorties : [label, probabilities]
+            logger.info("✅ Modèle ONNX chargé depuis %s : le score sera calculé avec onnxruntime.", ONNX_MODEL_PATH)
+        except ImportError:
+            logger.warning("onnxruntime n'est pas installé : %s ignoré, le score sera calculé avec scikit-learn.", ONNX_MODEL_PATH)
+        except Exception as e:
+            onnx_session = None
+            logger.warning("Impossible de charger %s (%s) : le score sera calculé avec scikit-learn.", ONNX_MODEL_PATH, e)
 
     # Vérification de l'existence des fichiers pour un démarrage robuste
     if not os.path.exists(MODEL_PATH):
         # Utilisation de RuntimeError pour empêcher le démarrage de l'API si les fichiers essentiels manquent
         raise RuntimeError(f"Fichier modèle non trouvé à : {MODEL_PATH}. L'application ne peut pas démarrer.")
-    if not os.path.exists(EXPLAINER_PATH):
-        raise RuntimeError(f"Fichier explainer non trouvé à : {EXPLAINER_PATH}. L'application ne peut pas démarrer.")
 
-    # Tentative de chargement des objets
+    # Tentative de chargement du modèle et de construction de l'explainer.
+    # Pas de mmap_mode : les arbres scikit-learn recopient leurs nœuds dans leurs propres tampons au
+    # désérialisage (Tree.__setstate__), chaque worker garde donc sa copie du modèle de toute façon.
     try:
         model = joblib.load(MODEL_PATH)
-        explainer = joblib.load(EXPLAINER_PATH)
-        print("✅ Modèle et Explainer chargés avec succès.")
+        # Reconstruire l'explainer (quelques ms) est plus rapide que de désérialiser un explainer picklé,
+        # et évite tout décalage de version entre le pickle et la bibliothèque shap installée.
+        explainer = build_explainer(model)
+        logger.info("✅ Modèle chargé et Explainer construit avec succès.")
     except Exception as e:
         # En cas d'erreur de chargement (ex: fichier corrompu, problème de compatibilité), lever une exception
         raise RuntimeError(f"❌ Erreur lors du chargement du modèle ou de l'explainer : {e}. L'application ne peut pas démarrer.")
 
-# 4. Point de terminaison API pour la prédiction de risque et l'explication SHAP
-@app.post("/predict")
-def predict(data: ClientData):
-    print(f"✅ Données reçues pour prédiction : {data.dict()}")
+    # La ligne d'entrée X est construite à partir des champs de ClientData, sans réindexation par nom :
+    # le schéma de la requête doit donc déclarer les fonctionnalités dans l'ordre de FEATURE_NAMES.
+    if ClientData.__struct_fields__ != FEATURE_NAMES:
+        raise RuntimeError(f"❌ Ordre des champs de ClientData ({list(ClientData.__struct_fields__)}) différent de celui attendu ({list(FEATURE_NAMES)}). L'application ne peut pas démarrer.")
 
-    # Convertir les données Pydantic en DataFrame Pandas
-    df = pd.DataFrame([data.dict()])
+    # Le modèle a été entraîné sur un DataFrame : on vérifie une seule fois, au démarrage, que l'ordre
+    # des colonnes vues à l'entraînement correspond à FEATURE_NAMES. On retire ensuite feature_names_in_
+    # pour que scikit-learn accepte un simple ndarray sans émettre d'avertissement à chaque requête.
+    fitted_names = getattr(model, "feature_names_in_", None)
+    if fitted_names is not None:
+        if tuple(fitted_names) != FEATURE_NAMES:
+            raise RuntimeError(f"❌ Ordre des fonctionnalités du modèle ({list(fitted_names)}) différent de celui attendu ({list(FEATURE_NAMES)}). L'application ne peut pas démarrer.")
+        del model.feature_names_in_
 
-    # --- Étape CRUCIALE : Réindexer le DataFrame pour assurer l'ordre correct des colonnes ---
-    # Cela garantit que les fonctionnalités sont passées à l'explainer et au modèle
-    # dans le même ordre et avec les mêmes noms que celui utilisé pendant l'entraînement.
+    # La structure de la sortie de explainer.shap_values ne dépend que de l'explainer chargé :
+    # on l'inspecte une seule fois ici sur une ligne factice, plutôt qu'à chaque requête.
     try:
-        df = df[expected_feature_order]
-        print(f"✅ DataFrame réindexé avec l'ordre attendu : {df.columns.tolist()}")
-    except KeyError as e:
-        # Si une fonctionnalité attendue (définie dans expected_feature_order) est manquante dans les données d'entrée
-        error_msg = (f"❌ Erreur de clé lors de la réindexation du DataFrame : {e}. "
-                     f"Assurez-vous que toutes les fonctionnalités de `expected_feature_order` sont présentes dans les données reçues.")
-        print(error_msg)
-        # Retourne une erreur HTTP 400 (Bad Request) au client
-        raise HTTPException(status_code=400, detail=error_msg)
-
-    # --- DÉBOGAGE PRÉ-PRÉDICTION : Affichage du DataFrame avant son utilisation ---
-    print("\n--- DÉBOGAGE PRÉ-PRÉDICTION ---")
-    print("DataFrame final à utiliser pour la prédiction et SHAP :")
-    print(df)
-    print(f"Forme du DataFrame (df.shape) : {df.shape}")
-    print(f"Colonnes du DataFrame (df.columns) : {df.columns.tolist()}")
-    print("--- FIN DÉBOGAGE PRÉ-PRÉDICTION ---\n")
-
-    # 5. Prédiction du score (probabilité de la classe positive)
-    score = None # Initialise le score à None pour s'assurer qu'il est défini ou qu'une erreur est levée
+        probe_output = explainer.shap_values(np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32), check_additivity=False)
+    except Exception as e:
+        raise RuntimeError(f"❌ Erreur lors du calcul SHAP de test : {e}. L'explainer est-il correct et compatible avec le modèle ? L'application ne peut pas démarrer.")
+    _install_shap_extractor(probe_output)
+
+    # Préchauffage : un passage complet (score + SHAP + extraction) sur une ligne factice initialise
+    # les imports paresseux et les tampons internes avant la première vraie requête.
+    try:
+        _compute_batch(np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32))
+    except RuntimeError as e:
+        raise RuntimeError(f"{e} L'application ne peut pas démarrer.")
+    logger.info("✅ Modèle et explainer préchauffés.")
+
+
+# Démarrage de la tâche de micro-batching (doit s'exécuter dans la boucle d'événements de l'application)
+@app.on_event("startup")
+async def start_batch_worker():
+    global batch_queue, batch_task, inference_pool
+    batch_queue = asyncio.Queue()
+    inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+    batch_task = asyncio.create_task(batch_worker())
+    logger.info("✅ Micro-batching actif (MAX_BATCH_SIZE=%d, MAX_LATENCY_MS=%s, INFERENCE_THREADS=%d).",
+                MAX_BATCH_SIZE, MAX_LATENCY_MS, INFERENCE_THREADS)
+
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    if batch_task is not None:
+        batch_task.cancel()
+    if inference_pool is not None:
+        inference_pool.shutdown(wait=False)
+
+
+def _build_shap_extractor(raw_shap_output):
+    """
+    Choisit, à partir d'une sortie SHAP de référence, la fonction qui extrait les valeurs SHAP
+    de la classe positive sous forme (n_samples, n_features). Retourne None si la structure n'est pas gérée.
+    """
+    if isinstance(raw_shap_output, list):
+        # C'est le cas typique si TreeExplainer retourne une liste de ndarrays (n_samples, n_features) par classe
+        if len(raw_shap_output) == 2 and isinstance(raw_shap_output[1], np.ndarray) and raw_shap_output[1].ndim == 2:
+            return lambda out: out[1] # SHAP pour la classe positive
+        # Fallback pour d'autres structures de liste (moins probable pour votre cas)
+        if len(raw_shap_output) > 0 and isinstance(raw_shap_output[0], np.ndarray) and raw_shap_output[0].ndim == 2:
+            return lambda out: out[0]
+    elif isinstance(raw_shap_output, np.ndarray):
+        # Forme (n_samples, n_features, n_classes) : classe positive = index 1 de la dernière dimension
+        if raw_shap_output.ndim == 3 and raw_shap_output.shape[2] > 1:
+            return lambda out: out[:, :, 1]
+        # Forme (n_samples, n_features) : une seule sortie
+        if raw_shap_output.ndim == 2:
+            return lambda out: out
+    return None
+
+
+def _install_shap_extractor(raw_shap_output):
+    """Inspecte une sortie SHAP de référence et installe l'extracteur correspondant (global extract_shap)."""
+    global extract_shap
+
+    # --- DÉBOGAGE DE LA SORTIE SHAP BRUTE (raw_shap_output) : TRÈS UTILE POUR COMPRENDRE LA STRUCTURE ---
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("--- DÉBOGAGE DE LA SORTIE SHAP BRUTE (raw_shap_output) ---")
+        logger.debug("Type de raw_shap_output : %s", type(raw_shap_output))
+        if isinstance(raw_shap_output, list):
+            logger.debug("raw_shap_output est une liste. Longueur : %d", len(raw_shap_output))
+            for i, item in enumerate(raw_shap_output):
+                if isinstance(item, np.ndarray):
+                    logger.debug("  Élément %d (ndarray) : Forme : %s, Dimensions : %d", i, item.shape, item.ndim)
+                else:
+                    logger.debug("  Élément %d : Type : %s", i, type(item))
+        elif isinstance(raw_shap_output, np.ndarray):
+            logger.debug("raw_shap_output est un ndarray. Forme : %s, Dimensions : %d", raw_shap_output.shape, raw_shap_output.ndim)
+        else:
+            logger.debug("Type de raw_shap_output inattendu : %s", type(raw_shap_output))
+        logger.debug("--- FIN DU DÉBOGAGE DE LA SORTIE SHAP BRUTE ---")
+
+    extractor = _build_shap_extractor(raw_shap_output)
+    if extractor is None:
+        raise RuntimeError("❌ Impossible d'extraire les valeurs SHAP de la structure renvoyée par l'explainer. La structure de raw_shap_output est inattendue ou non gérée. L'application ne peut pas démarrer.")
+
+    # Vérification de la cohérence entre le nombre de noms de features et les valeurs SHAP extraites
+    n_shap = extractor(raw_shap_output).shape[1]
+    if n_shap != len(FEATURE_NAMES):
+        raise RuntimeError(f"❌ ERREUR MAJEURE PERSISTANTE : Le nombre de noms de fonctionnalités ({len(FEATURE_NAMES)}) "
+                           f"ne correspond pas au nombre de valeurs SHAP ({n_shap}). "
+                           f"Cela indique une INCOHÉRENCE fondamentale entre l'explainer SHAP et les données d'entraînement. "
+                           f"Veuillez VÉRIFIER IMPÉRATIVEMENT comment votre explainer est construit par `build_explainer` dans `create_explainer.py` "
+                           f"et assurez-vous qu'il est entraîné sur TOUTES les fonctionnalités dans le BON ORDRE.")
+
+    extract_shap = extractor
+    logger.info("✅ Extracteur SHAP installé.")
+
+
+def _compute_batch(X):
+    """
+    Calcule en un seul appel le score et les valeurs SHAP de la classe positive pour un lot X de forme (B, 5).
+    Lève RuntimeError avec un message explicite en cas d'échec.
+    """
+    # 5. Prédiction du score (probabilité de la classe positive) pour tout le lot
     try:
         # model.predict_proba renvoie généralement un tableau numpy de forme (n_samples, n_classes)
-        # Pour une classification binaire, c'est (n_samples, 2).
-        # [0][1] prend la probabilité du premier échantillon pour la classe positive (index 1).
-        prediction_proba = model.predict_proba(df)
-        print(f"DEBUG: Type de sortie de model.predict_proba : {type(prediction_proba)}")
-        print(f"DEBUG: Forme de sortie de model.predict_proba : {prediction_proba.shape}")
-        
+        if onnx_session is not None:
+            prediction_proba = onnx_session.run([onnx_proba_output], {onnx_input_name: X})[0]
+        else:
+            prediction_proba = model.predict_proba(X)
+        logger.debug("Forme de sortie de model.predict_proba : %s", prediction_proba.shape)
+
         # Vérification de la forme pour extraire correctement la probabilité de la classe positive
         if prediction_proba.ndim == 2 and prediction_proba.shape[1] > 1:
-            score = prediction_proba[0][1] # Probabilité pour le premier échantillon, classe 1
+            scores = prediction_proba[:, 1]
         elif prediction_proba.ndim == 1:
             # Cas où predict_proba renverrait directement une probabilité 1D (moins commun pour binaire)
-            score = prediction_proba[0]
+            scores = prediction_proba
         else:
-            raise ValueError(f"Forme inattendue du résultat de predict_proba: {prediction_proba.shape}. Attendu (1, 2) ou (1,).")
-            
-        print(f"✅ Score de prédiction calculé : {score:.4f}")
-
+            raise ValueError(f"Forme inattendue du résultat de predict_proba: {prediction_proba.shape}. Attendu (B, 2) ou (B,).")
     except Exception as e:
-        # En cas d'erreur lors de la prédiction, retourner une erreur HTTP 500
         error_msg = f"❌ Erreur lors du calcul du score de prédiction : {e}. Vérifiez le modèle ou les données d'entrée."
-        print(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
+        logger.error(error_msg)
+        raise RuntimeError(error_msg)
 
-    # 6. Calcul des valeurs SHAP pour l'explicabilité du modèle
-    raw_shap_output = None # Initialise raw_shap_output à None
+    # 6. Calcul des valeurs SHAP pour l'explicabilité du modèle, en un seul appel pour tout le lot
+    # check_additivity=False : SHAP ne ré-évalue pas le modèle sur X pour vérifier que la somme des
+    # contributions redonne la prédiction (cette vérification doublait le parcours des arbres à chaque lot).
     try:
-        raw_shap_output = explainer.shap_values(df)
+        raw_shap_output = explainer.shap_values(X, check_additivity=False)
+        # 7. Extraction des shap_values de la classe positive, pour chaque échantillon du lot
+        # (dans le même try : une sortie de structure inattendue produit le même message détaillé)
+        shap_batch = extract_shap(raw_shap_output)
     except Exception as e:
-        # En cas d'erreur lors du calcul SHAP, retourner une erreur HTTP 500
         error_msg = f"❌ Erreur lors du calcul des valeurs SHAP : {e}. L'explainer est-il correct et compatible avec le modèle et les données ?"
-        print(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
+        logger.error(error_msg)
+        raise RuntimeError(error_msg)
 
-    # --- DÉBOGAGE DE LA SORTIE SHAP BRUTE (raw_shap_output) : TRÈS UTILE POUR COMPRENDRE LA STRUCTURE ---
-    print(f"\n--- DÉBOGAGE DE LA SORTIE SHAP BRUTE (raw_shap_output) ---")
-    print(f"Type de raw_shap_output : {type(raw_shap_output)}")
-    if isinstance(raw_shap_output, list):
-        print(f"raw_shap_output est une liste. Longueur : {len(raw_shap_output)}")
-        for i, item in enumerate(raw_shap_output):
-            if isinstance(item, np.ndarray):
-                print(f"  Élément {i} (ndarray) : Forme : {item.shape}, Dimensions : {item.ndim}")
-            else:
-                print(f"  Élément {i} : Type : {type(item)}")
-    elif isinstance(raw_shap_output, np.ndarray):
-        print(f"raw_shap_output est un ndarray. Forme : {raw_shap_output.shape}, Dimensions : {raw_shap_output.ndim}")
-    else:
-        print(f"Type de raw_shap_output inattendu : {type(raw_shap_output)}")
-    print(f"--- FIN DU DÉBOGAGE DE LA SORTIE SHAP BRUTE ---\n")
+    return scores, shap_batch
 
-    # 7. Extraction robuste des shap_values pour la classe positive (LA CORRECTION CLÉ EST ICI)
-    shap_values = None
-    if isinstance(raw_shap_output, list):
-        # C'est le cas typique si TreeExplainer retourne une liste de ndarrays pour chaque classe
-        if len(raw_shap_output) == 2 and isinstance(raw_shap_output[1], np.ndarray):
-            # raw_shap_output[1] contient les SHAP pour la classe positive.
-            # Sa forme peut être (n_samples, n_features) ou (n_features,) si n_samples=1
-            if raw_shap_output[1].ndim == 2 and raw_shap_output[1].shape[0] > 0:
-                shap_values = raw_shap_output[1][0] # Premier échantillon
-            elif raw_shap_output[1].ndim == 1:
-                shap_values = raw_shap_output[1] # Déjà 1D pour toutes les features
-            else:
-                print(f"Avertissement : raw_shap_output[1] a un nombre de dimensions inattendu : {raw_shap_output[1].ndim}.")
-        # Fallback pour d'autres structures de liste (moins probable pour votre cas)
-        elif len(raw_shap_output) > 0 and isinstance(raw_shap_output[0], np.ndarray):
-            if raw_shap_output[0].ndim == 2 and raw_shap_output[0].shape[0] > 0:
-                shap_values = raw_shap_output[0][0]
-            elif raw_shap_output[0].ndim == 1:
-                shap_values = raw_shap_output[0]
-            else:
-                print(f"Avertissement : raw_shap_output[0] a un nombre de dimensions inattendu : {raw_shap_output[0].ndim}.")
-    elif isinstance(raw_shap_output, np.ndarray):
-        # C'EST LE CAS QUE VOS LOGS ONT MONTRÉ : Forme (1, 5, 2)
-        if raw_shap_output.ndim == 3: # Forme (n_samples, n_features, n_classes)
-            # Pour extraire les SHAP du premier échantillon (index 0), pour toutes les fonctionnalités (slice :),
-            # et pour la classe positive (index 1 de la dernière dimension, qui est les classes)
-            if raw_shap_output.shape[0] > 0 and raw_shap_output.shape[2] > 1:
-                shap_values = raw_shap_output[0, :, 1] # <<<<< C'EST LA LIGNE CLÉ CORRIGÉE
-            else:
-                print(f"Avertissement : raw_shap_output 3D n'a pas la forme attendue pour l'extraction de la classe positive.")
-        elif raw_shap_output.ndim == 2: # Forme (n_samples, n_features)
-            if raw_shap_output.shape[0] > 0:
-                shap_values = raw_shap_output[0, :] # Prendre le premier échantillon
-            else:
-                print(f"Avertissement : raw_shap_output 2D est vide.")
-        elif raw_shap_output.ndim == 1: # Forme (n_features,)
-            shap_values = raw_shap_output
-    
-    # Vérification finale : Si shap_values n'a toujours pas été extrait, lever une erreur
-    if shap_values is None:
-        error_msg = "❌ Impossible d'extraire les valeurs SHAP de la structure renvoyée par l'explainer. La structure de raw_shap_output est inattendue ou non gérée."
-        print(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
-    
-    # 8. Vérification de la cohérence entre le nombre de noms de features et les valeurs SHAP extraites
-    feature_names = df.columns.tolist() # Utilise les noms de colonnes du DataFrame réindexé (garantit l'ordre correct)
-    print(f"feature_names (issues du DataFrame réindexé) : {feature_names}")
-    print(f"shap_values.shape (extraites après correction) : {shap_values.shape}")
-    
-    if len(feature_names) != len(shap_values):
-        # Si cette erreur se produit encore après la correction, cela signifie que
-        # l'explainer lui-même a été créé de manière incorrecte et ne produit pas
-        # les SHAP pour toutes les features attendues.
-        error_msg = (f"❌ ERREUR MAJEURE PERSISTANTE : Le nombre de noms de fonctionnalités ({len(feature_names)}) "
-                     f"ne correspond pas au nombre de valeurs SHAP ({len(shap_values)}). "
-                     f"Cela indique une INCOHÉRENCE fondamentale entre l'explainer SHAP et les données d'entraînement. "
-                     f"Veuillez VÉRIFIER IMPÉRATIVEMENT comment votre `explainer.pkl` a été créé dans `create_explainer.py` "
-                     f"et assurez-vous qu'il est entraîné sur TOUTES les fonctionnalités dans le BON ORDRE.")
-        print(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
-
-    # 9. Création du dictionnaire des impacts SHAP {feature_name: shap_value}
-    shap_impacts = {}
-    for i, feature in enumerate(feature_names):
-        shap_impacts[feature] = float(shap_values[i]) # Convertir en float pour une sérialisation JSON sûre
 
-    # 10. Tri des impacts par valeur absolue décroissante pour l'affichage
-    sorted_impacts = sorted(shap_impacts.items(), key=lambda x: abs(x[1]), reverse=True)
+async def _run_batch(X, futures, slots):
+    """Calcule un lot dans inference_pool, puis renvoie à chaque requête sa ligne de résultat."""
+    try:
+        scores, shap_batch = await asyncio.get_running_loop().run_in_executor(inference_pool, _compute_batch, X)
+    except Exception as e:
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+        return
+    finally:
+        slots.release() # Le thread de calcul est de nouveau disponible pour le lot suivant
+
+    for i, future in enumerate(futures):
+        if not future.done(): # La requête a pu être annulée (client déconnecté)
+            future.set_result((scores[i], shap_batch[i]))
+
+
+async def batch_worker():
+    """
+    Tâche de fond : regroupe jusqu'à MAX_BATCH_SIZE requêtes (ou ce qui arrive en MAX_LATENCY_MS),
+    puis confie le lot à un thread de inference_pool, qui calcule score et SHAP en un seul appel vectorisé.
+    Au plus INFERENCE_THREADS lots sont calculés en même temps.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(INFERENCE_THREADS)
+    while True:
+        # Attendre qu'un thread de calcul soit libre : pendant ce temps, les requêtes s'accumulent
+        # dans la file et formeront un lot plus grand
+        await slots.acquire()
+
+        # Attendre la première requête du lot, puis compléter le lot jusqu'à l'échéance
+        row, future = await batch_queue.get()
+        rows, futures = [row], [future]
+        deadline = loop.time() + MAX_LATENCY_MS / 1000
+        while len(rows) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row, future = await asyncio.wait_for(batch_queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            rows.append(row)
+            futures.append(future)
+
+        X = np.vstack(rows) # Tableau (B, 5) float32 contigu (ordre C), passé tel quel au modèle et à l'explainer
+        task = asyncio.create_task(_run_batch(X, futures, slots))
+        pending_batches.add(task)
+        task.add_done_callback(pending_batches.discard)
+
 
-    # 11. Construction de la liste d'explications lisibles par l'utilisateur
+# 4. Point de terminaison API pour la prédiction de risque et l'explication SHAP
+@app.post(
+    "/predict",
+    # Le corps est lu et validé par msgspec : on documente son schéma explicitement pour /docs
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {
+        "schema": msgspec.json.schema(ClientData)["$defs"]["ClientData"]
+    }}}},
+)
+async def predict(request: Request):
+    # Décodage + validation du JSON directement dans la structure ClientData
+    try:
+        data = client_data_decoder.decode(await request.body())
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        # Retourne une erreur HTTP 422 (Unprocessable Entity), comme le faisait la validation Pydantic
+        raise HTTPException(status_code=422, detail=f"❌ Données client invalides : {e}")
+    logger.debug("Données reçues pour prédiction : %s", data)
+
+    # Réponse déjà calculée pour exactement les mêmes données ?
+    cache_key = (data.age, data.revenu, data.anciennete, data.nb_incidents, data.score_credit)
+    cached_body = prediction_cache.get(cache_key)
+    if cached_body is not None:
+        prediction_cache.move_to_end(cache_key)
+        logger.debug("Réponse servie depuis le cache.")
+        return Response(content=cached_body, media_type="application/json") # Octets déjà sérialisés
+
+    # Construire directement la ligne d'entrée (1, 5) dans l'ordre de FEATURE_NAMES.
+    # On évite ainsi la création d'un DataFrame Pandas (et sa réindexation) à chaque requête.
+    # float32 : c'est le type attendu par les arbres scikit-learn et par TreeExplainer, qui sinon recopient X.
+    # Les valeurs SHAP renvoyées par l'explainer restent en float64 (seule l'entrée est quantifiée).
+    X = np.array([[data.age, data.revenu, data.anciennete, data.nb_incidents, data.score_credit]], dtype=np.float32)
+
+    # Envoi de la ligne à la file de micro-batching et attente du résultat de son lot (étapes 5 à 8)
+    future = asyncio.get_running_loop().create_future()
+    await batch_queue.put((X, future))
+    try:
+        score, shap_values = await future
+    except RuntimeError as e:
+        # En cas d'erreur lors de la prédiction ou du calcul SHAP, retourner une erreur HTTP 500
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        # Toute autre erreur transmise par le lot (ne devrait pas arriver) : réponse 500 explicite plutôt que nue
+        logger.exception("Erreur inattendue lors du calcul du lot.")
+        raise HTTPException(status_code=500, detail=f"❌ Erreur inattendue lors de la prédiction : {e}")
+
+    logger.debug("Score de prédiction calculé : %.4f", score)
+
+    # 9. Ordre des fonctionnalités par valeur absolue SHAP décroissante, calculé en un seul argsort NumPy
+    # (tri stable : à égalité, l'ordre de FEATURE_NAMES est conservé)
+    order = np.argsort(-np.abs(shap_values), kind="stable")
+
+    # 10-11. Dictionnaire des impacts SHAP {feature_name: shap_value} (dans l'ordre d'affichage) et liste
+    # d'explications lisibles par l'utilisateur, construits en une seule passe sur les fonctionnalités triées
+    impacts = shap_values.tolist() # Conversion unique en floats Python
+    positive = (shap_values > 0).tolist() # Signe de toutes les contributions en une comparaison vectorisée
+    shap_impacts = {}
     explanation_list = []
-    for feature, impact in sorted_impacts:
-        sign = "positivement" if impact > 0 else "négativement"
-        explanation_list.append(f"La fonctionnalité '{feature}' impacte {sign} la prédiction avec un poids de {impact:.3f}")
-    
-    print("✅ Prédiction et explications SHAP générées avec succès.")
+    for i in order:
+        feature = FEATURE_NAMES[i] # Même ordre que les colonnes de X
+        impact = impacts[i]
+        shap_impacts[feature] = impact
+        explanation_list.append(EXPLANATION_TMPLS[positive[i]] % (feature, impact))
+
+    logger.debug("Prédiction et explications SHAP générées avec succès.")
 
     # 12. Retour de la réponse finale de l'API
-    return {
+    # Le corps est sérialisé une seule fois par orjson : on évite le passage par jsonable_encoder,
+    # et les scalaires NumPy sont sérialisés sans conversion préalable en float.
+    body = orjson.dumps({
         "score": score, # Le score de risque calculé
         "shap_values": shap_impacts, # Les valeurs SHAP brutes par fonctionnalité
         "explanations": explanation_list # Les explications lisibles pour le dashboard
-    }
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+    if PREDICTION_CACHE_SIZE > 0:
+        # On met en cache le corps déjà sérialisé (immuable) plutôt que le dictionnaire
+        prediction_cache[cache_key] = body
+        if len(prediction_cache) > PREDICTION_CACHE_SIZE:
+            prediction_cache.popitem(last=False) # Éviction de l'entrée la moins récemment utilisée
+    return Response(content=body, media_type="application/json")
+
+
+# Lancement direct : `python api.py` (équivalent de `uvicorn api:app --workers $(nproc) --no-access-log`).
+# uvicorn choisit lui-même uvloop et httptools lorsqu'ils sont installés (loop="auto", http="auto" par défaut),
+# et se rabat sur asyncio / h11 sinon (ex. uvloop sous Windows).
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "api:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")), # Render fournit le port via la variable PORT
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)), # Un processus par CPU
+        access_log=False, # Pas de ligne de log formatée et écrite pour chaque requête
+    )
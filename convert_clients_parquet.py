@@ -0,0 +1,28 @@
+import pandas as pd
+import sys
+
+CLIENTS_CSV_PATH = "data/clients.csv"
+CLIENTS_PARQUET_PATH = "data/clients.parquet"
+
+def main():
+    try:
+        print(f"Chargement des clients depuis {CLIENTS_CSV_PATH}...")
+        clients = pd.read_csv(CLIENTS_CSV_PATH)
+    except FileNotFoundError:
+        print(f"Erreur: fichier {CLIENTS_CSV_PATH} introuvable")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Erreur lors du chargement des clients: {str(e)}")
+        sys.exit(1)
+
+    try:
+        print("Conversion au format Parquet...")
+        # Parquet conserve les types des colonnes (int64 / float64) : le dashboard n'a plus à reparser le texte
+        clients.to_parquet(CLIENTS_PARQUET_PATH, engine="pyarrow", index=False)
+        print(f"Succès: {len(clients)} clients sauvegardés dans {CLIENTS_PARQUET_PATH}")
+    except Exception as e:
+        print(f"Erreur lors de la conversion des clients: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import joblib
+import sys
+import os
+
+# Export optionnel : ni skl2onnx (conversion) ni onnxruntime (inférence dans l'API) ne figurent dans
+# requirements.txt. Les installer (pip install skl2onnx onnxruntime) pour utiliser app/model.onnx ;
+# sans onnxruntime, l'API ignore ce fichier et calcule le score avec scikit-learn.
+
+# Nombre de fonctionnalités en entrée du modèle (longueur de expected_feature_order dans api.py)
+N_FEATURES = 5
+
+def main():
+    if not os.path.exists("app"):
+        os.makedirs("app")
+
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        print("Erreur: skl2onnx n'est pas installé (pip install skl2onnx)")
+        sys.exit(1)
+
+    try:
+        print("Chargement du modèle depuis app/model.pkl...")
+        model = joblib.load("app/model.pkl")
+    except FileNotFoundError:
+        print("Erreur: fichier app/model.pkl introuvable")
+        print("Veuillez d'abord entraîner et sauvegarder le modèle")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Erreur lors du chargement du modèle: {str(e)}")
+        sys.exit(1)
+
+    try:
+        print("Conversion du modèle au format ONNX...")
+        # zipmap=False : les probabilités sortent sous forme de tenseur (n_samples, n_classes)
+        # et non de liste de dictionnaires, comme model.predict_proba
+        onnx_model = convert_sklearn(
+            model,
+            initial_types=[("input", FloatTensorType([None, N_FEATURES]))],
+            options={id(model): {"zipmap": False}},
+        )
+
+        print("Sauvegarde du modèle ONNX...")
+        with open("app/model.onnx", "wb") as f:
+            f.write(onnx_model.SerializeToString())
+        print("Succès: Modèle ONNX sauvegardé dans app/model.onnx")
+    except Exception as e:
+        print(f"Erreur lors de la conversion du modèle: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,27 +2,48 @@
 # coding: utf-8
 
 import streamlit as st
-import pandas as pd
-import requests
+import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pacsv # Lecture du CSV clients
+import pyarrow.parquet as pq
+import orjson # Sérialisation JSON rapide des requêtes et réponses de l'API
 import os
 import logging
-import re # Pour les expressions régulières afin de parser les explications SHAP
-from streamlit_echarts import st_echarts
+# requests et streamlit_echarts ne sont importés qu'au premier scoring (voir get_session et scoring_panel) :
+# le premier affichage du dashboard, qui ne montre que le tableau client, ne les charge pas
 
 logging.basicConfig(level=logging.INFO)
 
 st.set_page_config(page_title="Dashboard Néo-Banque", layout="centered")
 
+# URL de l'endpoint de scoring de l'API
+API_URL = os.getenv("API_URL", "https://neo-api-jigt.onrender.com/predict")
+
+
 # Fonction pour initialiser ou réinitialiser l'état de la session
 def reset_scoring_state():
     """Réinitialise les variables de session liées au scoring et aux explications SHAP."""
-    if 'score' in st.session_state:
-        del st.session_state['score']
-    if 'explanations' in st.session_state:
-        del st.session_state['explanations']
-    st.session_state['api_called'] = False
+    session_state = st.session_state
+    session_state.pop('score', None)
+    session_state.pop('explanations', None)
+    session_state['scored_id'] = None
+
+
+# Fin des phrases d'explication SHAP de l'API, après le nom de la fonctionnalité (précédant le poids)
+_SHAP_POS_TAIL = " impacte positivement la prédiction avec un poids de "
+_SHAP_NEG_TAIL = " impacte négativement la prédiction avec un poids de "
+
 
-# Fonction utilitaire pour parser les explications SHAP selon le nouveau format
+def _is_decimal(text):
+    """Indique si text est un nombre décimal simple (ex. "0.228", "-0.228"), comme l'écrit l'API."""
+    digits = text[1:] if text.startswith("-") else text
+    integer, _, fraction = digits.partition(".")
+    return integer.isdecimal() and (fraction == "" or fraction.isdecimal())
+
+
+# Fonction utilitaire pour parser les explications SHAP selon le nouveau format.
+# Les phrases renvoyées par l'API suivant un gabarit fixe, de simples recherches de sous-chaînes
+# (opérations en C) suffisent : pas d'expression régulière.
 def _parse_shap_explanation(explanation_text):
     """
     Parse une chaîne d'explication SHAP selon le nouveau format.
@@ -30,83 +51,277 @@ def _parse_shap_explanation(explanation_text):
     Ex: "La feature 'age' impacte négativement la prédiction avec un poids de -0.228"
     Retourne (direction_symbole_html, description, valeur_str, est_positif)
     """
-    match_positive = re.match(r"La (fonctionnalité|feature) '(.+?)' impacte positivement la prédiction avec un poids de (\d+\.?\d*)", explanation_text)
-    match_negative = re.match(r"La (fonctionnalité|feature) '(.+?)' impacte négativement la prédiction avec un poids de (-\d+\.?\d*)", explanation_text)
-
     # Flèche à angle droit : HTML unicode character
     arrow_html = "&#10148;" # Pour une flèche orientée à droite
 
-    if match_positive:
-        feature_name = match_positive.group(2).strip()
-        value = match_positive.group(3)
-        description = f"La fonctionnalité '{feature_name}' impacte positivement la prédiction avec un poids de "
-        return arrow_html, description, value, True
-    elif match_negative:
-        feature_name = match_negative.group(2).strip()
-        value = match_negative.group(3)
-        description = f"La fonctionnalité '{feature_name}' impacte négativement la prédiction avec un poids de "
-        return arrow_html, description, value, False
-    else:
+    # Rejet immédiat d'un texte libre qui ne suit pas le gabarit (une seule comparaison de préfixe)
+    if not explanation_text.startswith(("La fonctionnalité", "La feature")):
+        return arrow_html, explanation_text, "", False
+
+    parts = explanation_text.split("'", 2) # Le nom de la fonctionnalité est entre les deux premières apostrophes
+
+    # Le reste de la phrase doit suivre exactement le gabarit de l'API, puis se terminer par le poids.
+    # Deux comparaisons de préfixe sur la fin de la phrase donnent le sens de l'impact.
+    sign = value = None
+    if len(parts) == 3 and parts[0] in ("La fonctionnalité ", "La feature ") and parts[1].strip():
+        tail = parts[2]
+        if tail.startswith(_SHAP_POS_TAIL):
+            sign, value = "positivement", tail[len(_SHAP_POS_TAIL):]
+        elif tail.startswith(_SHAP_NEG_TAIL):
+            sign, value = "négativement", tail[len(_SHAP_NEG_TAIL):]
+
+    # Le poids doit être un nombre décimal, sans texte additionnel
+    if sign is None or not _is_decimal(value):
         # Cas par défaut si le format ne correspond pas
         return arrow_html, explanation_text, "", False # Par défaut, mettons-le en rouge pour signaler un problème de parsing
 
+    feature_name = parts[1].strip()
+    description = f"La fonctionnalité '{feature_name}' impacte {sign} la prédiction avec un poids de "
+    return arrow_html, description, value, sign == "positivement"
+
+
+# Couleurs d'un facteur SHAP selon le sens de son impact : (fond, valeur)
+_SHAP_CARD_COLORS = {
+    True: ("#e6ffe6", "#269f67"), # Vert clair / vert foncé si positif
+    False: ("#ffe6e6", "#ea4521"), # Rouge clair / rouge foncé si négatif
+}
+
+# Gabarit HTML d'un facteur SHAP, sur une seule ligne : seules les deux couleurs et le contenu varient.
+# La flèche est toujours grise (#6c757d).
+_SHAP_CARD_TMPL = (
+    '<div style="padding: 10px; margin-bottom: 8px; border-radius: 8px; background-color: {bg}; display: flex; '
+    'align-items: center; justify-content: space-between; box-shadow: 0 2px 4px rgba(0,0,0,0.05); min-height: 40px;">'
+    '<div style="font-size: 16px; color: #333; font-weight: 500; display: flex; align-items: center; flex-grow: 1;">'
+    '<span style="margin-right: 10px; font-size: 20px; color: #6c757d;">{arrow}</span><span>{desc}</span></div>'
+    '<div style="font-size: 16px; font-weight: bold; color: {score}; text-align: right; min-width: 60px;">{val}</div>'
+    '</div>'
+)
 
-# Fonction pour afficher un facteur SHAP stylisé
-def _display_shap_factor(direction_symbol_html, description, value, is_positive):
-    """Affiche un facteur SHAP avec le style conditionnel."""
-    # Couleurs de fond et de texte basées sur l'image fournie
-    bg_color = "#e6ffe6" if is_positive else "#ffe6e6" # Vert clair si positif, rouge clair si négatif
-    score_color = "#269f67" if is_positive else "#ea4521" # Vert foncé si positif, rouge foncé si négatif
-    arrow_color = "#6c757d" # Couleur de la flèche (gris) comme sur l'image
-
-    # Style pour la boîte globale
-    container_style = f"""
-        padding: 10px;
-        margin-bottom: 8px;
-        border-radius: 8px;
-        background-color: {bg_color};
-        display: flex;
-        align-items: center;
-        justify-content: space-between;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.05); /* Ombre légère */
-        min-height: 40px; /* Assure une hauteur minimale */
-    """
-    # Style pour la description et la flèche
-    desc_style = f"""
-        font-size: 16px;
-        color: #333; /* Couleur du texte de la description */
-        font-weight: 500;
-        display: flex;
-        align-items: center;
-        flex-grow: 1; /* Permet à la description de prendre l'espace disponible */
+
+# Fonction pour construire le HTML d'un facteur SHAP stylisé
+def _shap_factor_html(direction_symbol_html, description, value, is_positive):
+    """Retourne le HTML d'un facteur SHAP avec le style conditionnel."""
+    bg_color, score_color = _SHAP_CARD_COLORS[is_positive]
+    return _SHAP_CARD_TMPL.format(bg=bg_color, score=score_color, arrow=direction_symbol_html, desc=description, val=value)
+
+
+# Options ECharts de la jauge de score, construites une seule fois au chargement du module.
+# Seules les options différentes des valeurs par défaut d'ECharts sont envoyées au navigateur
+# (min 0, max 100, centre à 50%/50%, ancre masquée et détail affiché sont déjà les défauts).
+_GAUGE_BASE = {
+    "series": [
+        {
+            "type": "gauge",
+            "axisLine": {
+                "lineStyle": {
+                    "width": 10,
+                    "color": [
+                        [0.5, "#ea4521"],  # Rouge pour <= 50%
+                        [0.8, "#f7bb10"],  # Jaune pour <= 80%
+                        [1, "#269f67"]     # Vert pour > 80%
+                    ]
+                }
+            },
+            "pointer": {"show": False},
+            "axisTick": {"show": False},
+            "splitLine": {"show": False},
+            "axisLabel": {"show": False},
+            "detail": {
+                "offsetCenter": [0, "-10%"],
+                "valueAnimation": True,
+                "formatter": "{value}%",
+                "fontSize": 30,
+                "fontWeight": "bolder",
+                "color": "#333",
+            },
+            "data": [{"value": 0}], # Remplacé par le score dans gauge_options
+            "progress": {
+                "show": True,
+                "width": 10
+            },
+            "radius": "80%",
+            "itemStyle": {"color": "#269f67"},
+        }
+    ]
+}
+
+
+def gauge_options(pct):
+    """Retourne les options de la jauge pour un score pct (en %), sans modifier le gabarit."""
+    # Seul le chemin jusqu'à "data" est recopié : le reste du gabarit (jamais modifié) est partagé
+    return {"series": [{**_GAUGE_BASE["series"][0], "data": [{"value": pct}]}]}
+
+
+# Messages d'éligibilité affichés sous la jauge, indexés par tranche de score (0 : <= 50%, 1 : <= 80%, 2 : > 80%)
+ELIGIBILITY_HTML = tuple(
+    f"<p style='text-align: center; color: {color}; font-weight: bold;'>{title}</p>"
+    f"<p style='text-align: center;'>{subtitle}</p>"
+    for color, title, subtitle in (
+        ("#ea4521", "❌ Inéligible probable", "Score faible pour l'octroi de crédit"),
+        ("#f7bb10", "⚠️ Potentiellement éligible", "Score bon pour l'octroi de crédit, mais à étudier"),
+        ("#269f67", "✅ Éligible", "Score excellent pour l'octroi de crédit"),
+    )
+)
+
+
+# Types des colonnes du fichier clients, réduits à la plage utile des valeurs (âge et incidents tiennent dans
+# un int8, l'ancienneté, éventuellement en mois, dans un int16 ; float32 représente exactement les revenus et
+# scores entiers jusqu'à 2**24). Une valeur hors plage fait échouer la lecture (pa.ArrowInvalid) au lieu
+# d'être tronquée silencieusement.
+CLIENT_DTYPES = {"age": "int8", "revenu": "float32", "anciennete": "int16", "nb_incidents": "int8", "score_credit": "float32"}
+CLIENT_SCHEMA = pa.schema([(column, pa.from_numpy_dtype(np.dtype(dtype))) for column, dtype in CLIENT_DTYPES.items()])
+
+
+def _parquet_is_fresh():
+    """Indique si data/clients.parquet existe et n'est pas plus ancien que data/clients.csv."""
+    if not os.path.exists("data/clients.parquet"):
+        return False
+    if not os.path.exists("data/clients.csv"):
+        return True
+    if os.path.getmtime("data/clients.parquet") >= os.path.getmtime("data/clients.csv"):
+        return True
+    logging.warning("data/clients.parquet est plus ancien que data/clients.csv : lecture du CSV "
+                    "(relancer convert_clients_parquet.py pour régénérer le fichier Parquet).")
+    return False
+
+
+# Chargement des données clients, mis en cache : le CSV n'est lu qu'une fois par processus,
+# et non à chaque rerun du script (chaque interaction avec un widget). Pas de spinner : la lecture est quasi instantanée.
+@st.cache_data(show_spinner=False)
+def load_clients():
     """
-    # Style pour la valeur (score)
-    value_style = f"""
-        font-size: 16px;
-        font-weight: bold;
-        color: {score_color};
-        text-align: right;
-        min-width: 60px; /* Assure un espace suffisant pour la valeur */
+    Charge les clients et ajoute une colonne 'id' (position de la ligne).
+    data/clients.parquet (généré par convert_clients_parquet.py) est lu en priorité s'il est au moins aussi récent
+    que data/clients.csv ; sinon (Parquet absent ou CSV modifié depuis la conversion) le CSV est lu.
     """
-    # Style pour la flèche
-    arrow_style = f"""
-        margin-right: 10px;
-        font-size: 20px;
-        color: {arrow_color}; /* La flèche est toujours grise selon l'image */
+    if _parquet_is_fresh():
+        # Pas de reparsing du texte. Conversion vérifiée (safe=True) : un dépassement lève pa.ArrowInvalid,
+        # comme pour le CSV, au lieu d'un astype NumPy qui tronquerait la valeur (200 -> -56 en int8)
+        clients = pq.read_table("data/clients.parquet", columns=CLIENT_SCHEMA.names).cast(CLIENT_SCHEMA, safe=True).to_pandas()
+    else:
+        # Lecteur CSV de pyarrow : analyse multithreadée par blocs de block_size octets, avec des types imposés
+        # (pas d'inférence des types colonne par colonne), puis conversion en DataFrame à colonnes NumPy
+        clients = pacsv.read_csv(
+            "data/clients.csv",
+            read_options=pacsv.ReadOptions(block_size=8 << 20, use_threads=True),
+            convert_options=pacsv.ConvertOptions(
+                column_types=CLIENT_SCHEMA
+            ),
+        ).to_pandas()
+    clients.insert(0, "id", np.arange(len(clients), dtype=np.int32)) # Ajout en place, sans reset_index ni rename
+    return clients
+
+
+# Colonnes des données clients sous forme de tableaux NumPy (une entrée par colonne), partagés sans copie :
+# lire un client revient à 6 accès ndarray[i] au lieu de matérialiser une Series avec clients.loc
+CLIENT_COLUMNS = ("id", "age", "revenu", "anciennete", "nb_incidents", "score_credit")
+
+
+@st.cache_resource(show_spinner=False)
+def client_columns():
+    """Retourne {nom de colonne: ndarray} pour les colonnes CLIENT_COLUMNS des données clients."""
+    clients = load_clients()
+    return {column: clients[column].to_numpy() for column in CLIENT_COLUMNS}
+
+
+# Données envoyées à l'API pour un client, calculées une seule fois par client
+@st.cache_data(show_spinner=False)
+def client_payload(client_id):
+    """Retourne le corps JSON de la requête /predict pour le client d'identifiant client_id."""
+    columns = client_columns()
+    return {
+        "age": int(columns["age"][client_id]),
+        "revenu": float(columns["revenu"][client_id]),
+        "anciennete": int(columns["anciennete"][client_id]),
+        "nb_incidents": int(columns["nb_incidents"][client_id]),
+        "score_credit": float(columns["score_credit"][client_id]),
+    }
+
+
+# Libellés du tableau "Informations Client", dans l'ordre d'affichage
+CLIENT_INFO_LABELS = [
+    "ID Client",
+    "Âge",
+    "Revenu annuel",
+    "Ancienneté",
+    "Incidents de paiement",
+    "Score de crédit initial"
+]
+
+
+# Valeurs mises en forme du tableau "Informations Client" pour tous les clients, calculées colonne par colonne
+# une seule fois par processus : l'affichage d'un client n'est plus qu'une lecture de chaînes déjà formatées
+@st.cache_resource(show_spinner=False)
+def client_info_columns():
+    """Retourne les valeurs formatées du tableau d'informations, une liste par ligne de CLIENT_INFO_LABELS."""
+    clients = load_clients()
+    return (
+        clients["id"].astype(str).tolist(),
+        (clients["age"].astype(str) + " ans").tolist(),
+        clients["revenu"].map(lambda revenu: f"{revenu:,.0f} €").tolist(),
+        (clients["anciennete"].astype(str) + " ans").tolist(),
+        clients["nb_incidents"].astype(str).tolist(),
+        clients["score_credit"].map("{:.1f}".format).tolist(),
+    )
+
+
+# Tableau "Informations Client" rendu en HTML statique (6 lignes) : pas de sérialisation Arrow
+# ni de grille interactive comme avec st.dataframe. Construit une seule fois par client.
+@st.cache_data(show_spinner=False)
+def client_info_html(client_id):
+    """Retourne le tableau HTML des informations du client client_id."""
+    rows = "".join(
+        f"<tr><td>{label}</td><td>{values[client_id]}</td></tr>"
+        for label, values in zip(CLIENT_INFO_LABELS, client_info_columns())
+    )
+    return f"<table><thead><tr><th>Caractéristique</th><th>Valeur</th></tr></thead><tbody>{rows}</tbody></table>"
+
+
+# Session HTTP unique, partagée par tous les reruns et toutes les sessions du dashboard : le pool de connexions
+# d'urllib3 conserve la connexion TCP/TLS vers l'API (keep-alive) au lieu de la rouvrir à chaque scoring
+@st.cache_resource
+def get_session():
+    """Retourne la session requests utilisée pour appeler l'API de scoring."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    # Nouvelles tentatives sur les erreurs de passerelle (API en cours de réveil sur Render, par exemple).
+    # POST est inclus : /predict ne modifie aucun état côté serveur.
+    retries = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Appel de l'API de scoring, mis en cache par valeurs d'entrée : re-sélectionner un client déjà scoré
+# ne refait pas d'aller-retour réseau. Les arguments sont des scalaires pour un hachage peu coûteux ;
+# une exception (API indisponible...) n'est pas mise en cache.
+@st.cache_data(ttl=3600, show_spinner="Scoring…")
+def score_client(age, revenu, anciennete, nb_incidents, score_credit):
     """
-
-    html_content = f"""
-    <div style="{container_style}">
-        <div style="{desc_style}">
-            <span style="{arrow_style}">{direction_symbol_html}</span>
-            <span>{description}</span>
-        </div>
-        <div style="{value_style}">
-            {value}
-        </div>
-    </div>
+    Retourne (score, facteurs) calculés par l'API pour les caractéristiques données, où facteurs est la liste
+    des explications SHAP déjà analysées par _parse_shap_explanation.
     """
-    st.markdown(html_content, unsafe_allow_html=True)
+    input_data = {
+        "age": age,
+        "revenu": revenu,
+        "anciennete": anciennete,
+        "nb_incidents": nb_incidents,
+        "score_credit": score_credit,
+    }
+    logging.info(f"Envoi de la requête à l'API : {API_URL}")
+    # Corps encodé et réponse décodée avec orjson plutôt qu'avec le module json de la bibliothèque standard
+    # (l'en-tête Content-Type: application/json est déjà porté par la session)
+    res = get_session().post(API_URL, data=orjson.dumps(input_data), timeout=(3, 10)) # (connexion, lecture)
+    res.raise_for_status()
+    response_data = orjson.loads(res.content)
+    # Les explications sont analysées une seule fois par réponse de l'API, et non à chaque affichage
+    shap_factors = [_parse_shap_explanation(text) for text in response_data.get("explanations", [])]
+    return response_data["score"], shap_factors
 
 
 # Ajout de la section RGPD dans la sidebar
@@ -126,172 +341,95 @@ with st.sidebar.expander("🔐 Données & RGPD"):
 
 # Charger les données des clients
 try:
-    clients = pd.read_csv("data/clients.csv").reset_index().rename(columns={"index": "id"})
+    columns = client_columns()
 except FileNotFoundError:
     st.error("Erreur : Le fichier 'data/clients.csv' est introuvable. Veuillez le placer dans le répertoire 'data'.")
     st.stop()
+except pa.ArrowInvalid as e:
+    # Valeur non numérique ou hors de la plage du type de sa colonne (voir CLIENT_DTYPES)
+    st.error(f"Erreur : Les données clients sont invalides : {e}")
+    st.stop()
 
 st.title("📊 Dashboard conseiller")
 
 # Sélection du client
 selected_id = st.selectbox(
     "Choisir un client",
-    clients.index,
-    key="client_selector",
-    on_change=reset_scoring_state # Appelle la fonction de réinitialisation
+    range(len(columns["id"])), # L'id d'un client est sa position dans le fichier
+    key="client_selector" # Pas de callback de réinitialisation : un score d'un autre client est ignoré à l'affichage
 )
 
-client = clients.loc[selected_id]
-
-# Initialisation de api_called à False si ce n'est pas déjà fait
-if 'api_called' not in st.session_state:
-    st.session_state['api_called'] = False
-
-# Utilisation de st.columns pour un agencement comme sur l'image
-col1, col2 = st.columns([0.6, 0.4])
-
-with col1:
-    st.subheader("Informations Client")
-
-    # Création d'un DataFrame pour les informations du client
-    client_info_df = pd.DataFrame({
-        "Caractéristique": [
-            "ID Client",
-            "Âge",
-            "Revenu annuel",
-            "Ancienneté",
-            "Incidents de paiement",
-            "Score de crédit initial"
-        ],
-        "Valeur": [
-            str(client['id']),
-            f"{int(client['age'])} ans",
-            f"{float(client['revenu']):,.0f} €",
-            f"{int(client['anciennete'])} ans",
-            str(int(client['nb_incidents'])),
-            f"{float(client['score_credit']):.1f}"
-        ]
-    })
-
-    # Afficher le DataFrame
-    st.dataframe(client_info_df, hide_index=True)
-
-    # Bouton pour envoyer pour scoring
-    if st.button("📤 Envoyer pour scoring", key="score_button"):
-        API_URL = os.getenv("API_URL", "https://neo-api-jigt.onrender.com/predict")
-
-        input_data = {
-            "age": int(client["age"]),
-            "revenu": float(client["revenu"]),
-            "anciennete": int(client["anciennete"]),
-            "nb_incidents": int(client["nb_incidents"]),
-            "score_credit": float(client["score_credit"]),
-        }
 
-        try:
-            logging.info(f"Envoi de la requête à l'API pour le client ID: {client['id']}")
-            res = requests.post(API_URL, json=input_data, timeout=10)
-            res.raise_for_status()
-            response_data = res.json()
-            score = response_data["score"]
-            explanations_from_api = response_data.get("explanations", [])
-
-            # Stockage des résultats dans st.session_state
-            st.session_state['score'] = score
-            st.session_state['explanations'] = explanations_from_api
-            st.session_state['api_called'] = True
-
-        except requests.exceptions.ConnectionError:
-            st.error(f"Erreur de connexion à l’API. Vérifiez que l'API est accessible à l'adresse {API_URL}.")
-            reset_scoring_state()
-        except requests.exceptions.RequestException as e:
-            st.error(f"Erreur lors de la communication avec l’API : {e}. Vérifiez l'URL et la configuration de l'API.")
-            reset_scoring_state()
-        except Exception as e:
-            st.error(f"Une erreur inattendue s'est produite : {e}")
-            reset_scoring_state()
-
-# Vérifier si l'API a été appelée et afficher les résultats (jauge et SHAP)
-if st.session_state['api_called']:
-    score = st.session_state['score']
-    explanations_from_api = st.session_state['explanations']
-
-    with col2:
-        st.subheader("Score de Crédit")
-        credit_score_percentage = round(score * 100, 1)
-
-        options = {
-            "series": [
-                {
-                    "type": "gauge",
-                    "axisLine": {
-                        "lineStyle": {
-                            "width": 10,
-                            "color": [
-                                [0.5, "#ea4521"],  # Rouge pour <= 50%
-                                [0.8, "#f7bb10"],  # Jaune pour <= 80%
-                                [1, "#269f67"]     # Vert pour > 80%
-                            ]
-                        }
-                    },
-                    "pointer": {"show": False},
-                    "axisTick": {"show": False},
-                    "splitLine": {"show": False},
-                    "axisLabel": {"show": False},
-                    "detail": {
-                        "show": True,
-                        "offsetCenter": [0, "-10%"],
-                        "valueAnimation": True,
-                        "formatter": "{value}%",
-                        "fontSize": 30,
-                        "fontWeight": "bolder",
-                        "color": "#333",
-                    },
-                    "title": {
-                        "show": True,
-                        "offsetCenter": [0, "120%"],
-                        "fontSize": 14,
-                        "color": "#333",
-                        "formatter": ""
-                    },
-                    "data": [{"value": credit_score_percentage}],
-                    "progress": {
-                        "show": True,
-                        "width": 10
-                    },
-                    "splitNumber": 0,
-                    "radius": "80%",
-                    "center": ["50%", "50%"],
-                    "min": 0,
-                    "max": 100,
-                    "anchor": {"show": False},
-                    "itemStyle": {"color": "#269f67"},
-                }
-            ]
-        }
-        st_echarts(options=options, height="200px")
-
-        if score > 0.8:
-            st.markdown("<p style='text-align: center; color: #269f67; font-weight: bold;'>✅ Éligible</p>", unsafe_allow_html=True)
-            st.markdown("<p style='text-align: center;'>Score excellent pour l'octroi de crédit</p>", unsafe_allow_html=True)
-        elif score > 0.5:
-            st.markdown("<p style='text-align: center; color: #f7bb10; font-weight: bold;'>⚠️ Potentiellement éligible</p>", unsafe_allow_html=True)
-            st.markdown("<p style='text-align: center;'>Score bon pour l'octroi de crédit, mais à étudier</p>", unsafe_allow_html=True)
+# Panneau de scoring (informations client, bouton, jauge et facteurs SHAP) exécuté comme fragment :
+# un clic sur le bouton ne réexécute que cette fonction, et non tout le script (sidebar RGPD, sélection du client...)
+@st.fragment
+def scoring_panel(client_id):
+    """Affiche les informations du client, le bouton de scoring et les résultats de l'API."""
+    # Utilisation de st.columns pour un agencement comme sur l'image
+    col1, col2 = st.columns([0.6, 0.4])
+
+    with col1:
+        st.subheader("Informations Client")
+
+        # Afficher le tableau des informations du client (mis en forme une seule fois par client)
+        st.markdown(client_info_html(client_id), unsafe_allow_html=True)
+
+        # Bouton pour envoyer pour scoring
+        if st.button("📤 Envoyer pour scoring", key="score_button"):
+            import requests # Pour les exceptions ci-dessous
+
+            input_data = client_payload(client_id)
+
+            try:
+                logging.info(f"Scoring du client ID: {client_id}")
+                score, shap_factors = score_client(**input_data)
+
+                # Stockage des résultats dans st.session_state
+                session_state = st.session_state
+                session_state['score'] = score
+                session_state['explanations'] = shap_factors
+                session_state['scored_id'] = client_id # Client auquel correspondent le score et les explications
+
+            except requests.exceptions.ConnectionError:
+                st.error(f"Erreur de connexion à l’API. Vérifiez que l'API est accessible à l'adresse {API_URL}.")
+                reset_scoring_state()
+            except requests.exceptions.RequestException as e:
+                st.error(f"Erreur lors de la communication avec l’API : {e}. Vérifiez l'URL et la configuration de l'API.")
+                reset_scoring_state()
+            except Exception as e:
+                st.error(f"Une erreur inattendue s'est produite : {e}")
+                reset_scoring_state()
+
+    # Vérifier si l'API a été appelée pour ce client et afficher les résultats (jauge et SHAP).
+    # Les résultats d'un autre client (sélection changée depuis) sont invalidés ici, au moment de l'affichage.
+    session_state = st.session_state
+    if session_state.get('scored_id') == client_id:
+        score = session_state['score']
+        shap_factors = session_state['explanations']
+
+        with col2:
+            st.subheader("Score de Crédit")
+            credit_score_percentage = round(score * 100, 1)
+
+            from streamlit_echarts import st_echarts
+            st_echarts(options=gauge_options(credit_score_percentage), height="200px")
+
+            # Tranche 0 (<= 50%), 1 (<= 80%) ou 2 (> 80%), qui indexe directement le message d'éligibilité
+            st.markdown(ELIGIBILITY_HTML[(score > 0.5) + (score > 0.8)], unsafe_allow_html=True)
+
+        st.subheader("Comprendre le score (Facteurs d'influence SHAP)")
+        if shap_factors:
+            # Appliquer le style conditionnel aux explications SHAP (déjà analysées par score_client).
+            # Tous les facteurs sont envoyés au navigateur en un seul appel à st.markdown, et non un par facteur.
+            st.markdown("".join(_shap_factor_html(*factor) for factor in shap_factors), unsafe_allow_html=True)
         else:
-            st.markdown("<p style='text-align: center; color: #ea4521; font-weight: bold;'>❌ Inéligible probable</p>", unsafe_allow_html=True)
-            st.markdown("<p style='text-align: center;'>Score faible pour l'octroi de crédit</p>", unsafe_allow_html=True)
-
-    st.subheader("Comprendre le score (Facteurs d'influence SHAP)")
-    if explanations_from_api:
-        # Appliquer le style conditionnel aux explications SHAP
-        for explanation_text in explanations_from_api:
-            direction_symbol_html, description, value, is_positive = _parse_shap_explanation(explanation_text)
-            _display_shap_factor(direction_symbol_html, description, value, is_positive)
+            st.info("Aucune explication détaillée disponible pour le moment ou une erreur s'est produite côté API.")
     else:
-        st.info("Aucune explication détaillée disponible pour le moment ou une erreur s'est produite côté API.")
-else:
-    with col2:
-        st.subheader("Score de Crédit")
-        st.info("Cliquez sur 'Envoyer pour scoring' pour calculer le score.")
-    st.subheader("Comprendre le score (Facteurs d'influence SHAP)")
-    st.info("Les facteurs d'influence SHAP apparaîtront après le calcul du score.")
+        with col2:
+            st.subheader("Score de Crédit")
+            st.info("Cliquez sur 'Envoyer pour scoring' pour calculer le score.")
+        st.subheader("Comprendre le score (Facteurs d'influence SHAP)")
+        st.info("Les facteurs d'influence SHAP apparaîtront après le calcul du score.")
+
+
+scoring_panel(selected_id)